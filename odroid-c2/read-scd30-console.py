@@ -1,16 +1,37 @@
 #!/usr/bin/python3
 
-import subprocess
 import time
-import crcmod
 import struct
+from collections import namedtuple
+from smbus2 import SMBus, i2c_msg
+
+def make_crc8_table(polynomial=0x31):
+    """return 256 byte CRC-8 lookup table for polynomial"""
+    table = bytearray(256)
+    for i in range(256):
+        crc = i
+        for _ in range(8):
+            if crc & 0x80:
+                crc = ((crc << 1) ^ polynomial) & 0xff
+            else:
+                crc = (crc << 1) & 0xff
+        table[i] = crc
+    return bytes(table)
+
+# CRC-8 lookup table for SCD30 polynomial 0x31
+CRC8_TBL = make_crc8_table(0x31)
+
+def crc8hash(data):
+    """hash function used by SCD30 (CRC-8, polynomial 0x31, init 0xff)"""
+    crc = 0xff
+    for b in data:
+        crc = CRC8_TBL[crc ^ b]
+    return crc
 
-# hash function used by SCD30
-crc8hash = crcmod.mkCrcFun(0x131, initCrc=0xff, rev=False)
 # I2C bus 1 on ODROID-C2
-i2cbus = '1'
+i2cbus = 1
 # SCD30 I2C bus address
-scd30_addr = '0x61'
+scd30_addr = 0x61
 # SCD30 measurement interval (s)
 scd30_measurement_interval = 10
 # SCD30 temperature offset (1/100°C)
@@ -23,12 +44,6 @@ def unpack_word(data_bytes):
     word = int.from_bytes(data_bytes[0:2], byteorder='big')
     return word
 
-def unpack_bytes(data_bytes):
-    crc = crc8hash(data_bytes[:2])
-    if crc != data_bytes[2]:
-        raise ValueError(f"CRC mismatch ({hex(crc)}!={hex(data_bytes[2])}")
-    return data_bytes[0:2]
-
 def pack_word(word):
     data_bytes = bytearray(3)
     data_bytes[0:2] = word.to_bytes(2, byteorder='big')
@@ -39,117 +54,131 @@ def pack_word(word):
 def get_data_ready(bus, addr):
     # send command 0x0202
     #print(f"sending ready command")
-    subprocess.run(['/usr/sbin/i2ctransfer', '-y', i2cbus, 'w2@' + addr, '0x02', '0x02'],
-                   check=True)
+    bus.i2c_rdwr(i2c_msg.write(addr, [0x02, 0x02]))
+    time.sleep(0.003)
     # read 3 bytes
-    ret = subprocess.run(['/usr/sbin/i2ctransfer', '-y', i2cbus, 'r3@' + addr],
-                         capture_output=True, text=True, check=True)
-    data = ret.stdout
-    #print(f"transfer got:{data}")
-    data_bytes = bytearray.fromhex(data.replace('0x', ''))
+    msg = i2c_msg.read(addr, 3)
+    bus.i2c_rdwr(msg)
+    data_bytes = bytes(msg)
+    #print(f"transfer got:{data_bytes.hex(' ')}")
     ready_status = unpack_word(data_bytes)
     return ready_status
 
 def get_measurement_interval(bus, addr):
     # send command 0x4600
     #print(f"sending get-measurement-interval command")
-    subprocess.run(['/usr/sbin/i2ctransfer', '-y', i2cbus, 'w2@' + addr, '0x46', '0x00'],
-                   check=True)
+    bus.i2c_rdwr(i2c_msg.write(addr, [0x46, 0x00]))
+    time.sleep(0.003)
     # read 3 bytes
-    ret = subprocess.run(['/usr/sbin/i2ctransfer', '-y', i2cbus, 'r3@' + addr],
-                         capture_output=True, text=True, check=True)
-    data = ret.stdout
-    #print(f"transfer got:{data}")
-    data_bytes = bytearray.fromhex(data.replace('0x', ''))
+    msg = i2c_msg.read(addr, 3)
+    bus.i2c_rdwr(msg)
+    data_bytes = bytes(msg)
+    #print(f"transfer got:{data_bytes.hex(' ')}")
     data_word = unpack_word(data_bytes)
     return data_word
 
 def set_measurement_interval(bus, addr, interval):
-    data_bytes = pack_word(interval)
     # send command 0x4600
     #print(f"sending set-measurement-interval command")
-    cmd = ['/usr/sbin/i2ctransfer', '-y', i2cbus, 'w5@' + addr, '0x46', '0x00']
-    cmd += [hex(b) for b in data_bytes]
-    print(f"cmd: {cmd}")
-    subprocess.run(cmd, check=True)
+    bus.i2c_rdwr(i2c_msg.write(addr, b'\x46\x00' + pack_word(interval)))
+    time.sleep(0.003)
     return interval
 
 def get_temp_offset(bus, addr):
     # send command 0x5403
     #print(f"sending get-temp-offset command")
-    subprocess.run(['/usr/sbin/i2ctransfer', '-y', i2cbus, 'w2@' + addr, '0x54', '0x03'],
-                   check=True)
+    bus.i2c_rdwr(i2c_msg.write(addr, [0x54, 0x03]))
+    time.sleep(0.003)
     # read 3 bytes
-    ret = subprocess.run(['/usr/sbin/i2ctransfer', '-y', i2cbus, 'r3@' + addr],
-                         capture_output=True, text=True, check=True)
-    data = ret.stdout
-    #print(f"transfer got:{data}")
-    data_bytes = bytearray.fromhex(data.replace('0x', ''))
+    msg = i2c_msg.read(addr, 3)
+    bus.i2c_rdwr(msg)
+    data_bytes = bytes(msg)
+    #print(f"transfer got:{data_bytes.hex(' ')}")
     data_word = unpack_word(data_bytes)
     return data_word
 
+# SCD30 measurement values
+Measurement = namedtuple('Measurement', ('co2', 'temp', 'rh'))
+
+# scratch buffer for float conversion
+_scratch = bytearray(4)
+
 def read_measurement(bus, addr):
     # send command 0x0300
     #print(f"sending read measurement command")
-    subprocess.run(['/usr/sbin/i2ctransfer', '-y', i2cbus, 'w2@' + addr, '0x03', '0x00'],
-                   check=True)
+    bus.i2c_rdwr(i2c_msg.write(addr, [0x03, 0x00]))
+    time.sleep(0.003)
     # read 18 bytes
-    ret = subprocess.run(['/usr/sbin/i2ctransfer', '-y', i2cbus, 'r18@' + addr],
-                         capture_output=True, text=True, check=True)
-    data = ret.stdout
-    #print(f"transfer got:{data}")
-    data_bytes = bytearray.fromhex(data.replace('0x', ''))
+    msg = i2c_msg.read(addr, 18)
+    bus.i2c_rdwr(msg)
+    data_bytes = bytes(msg)
     #print(f"got read measurement msg={data_bytes.hex(' ')}")
+    # 6 words of 2 bytes, each followed by CRC (inlined crc8hash)
+    tbl = CRC8_TBL
+    for i in range(0, 18, 3):
+        crc = tbl[tbl[0xff ^ data_bytes[i]] ^ data_bytes[i + 1]]
+        if crc != data_bytes[i + 2]:
+            raise ValueError(f"CRC mismatch ({hex(crc)}!={hex(data_bytes[i + 2])}")
+    # each float is two words, copy them without CRC bytes
+    f = _scratch
     # CO2
-    co2_h_bytes = data_bytes[0:3]
-    co2_h = unpack_bytes(co2_h_bytes)
-    co2_l_bytes = data_bytes[3:6]
-    co2_l = unpack_bytes(co2_l_bytes)
-    co2 = struct.unpack('!f', co2_h + co2_l)[0]
-    #print(f"co2_h={co2_h.hex()}, co2_l={co2_l.hex()}, co2={co2}")
+    f[0] = data_bytes[0]
+    f[1] = data_bytes[1]
+    f[2] = data_bytes[3]
+    f[3] = data_bytes[4]
+    co2 = struct.unpack_from('>f', f)[0]
     # Temp
-    temp_h_bytes = data_bytes[6:9]
-    temp_h = unpack_bytes(temp_h_bytes)
-    temp_l_bytes = data_bytes[9:12]
-    temp_l = unpack_bytes(temp_l_bytes)
-    temp = struct.unpack('!f', temp_h + temp_l)[0]
+    f[0] = data_bytes[6]
+    f[1] = data_bytes[7]
+    f[2] = data_bytes[9]
+    f[3] = data_bytes[10]
+    temp = struct.unpack_from('>f', f)[0]
     # RH
-    rh_h_bytes = data_bytes[12:15]
-    rh_h = unpack_bytes(rh_h_bytes)
-    rh_l_bytes = data_bytes[15:18]
-    rh_l = unpack_bytes(rh_l_bytes)
-    rh = struct.unpack('!f', rh_h + rh_l)[0]
-    
-    return {'co2': co2, 'temp': temp, 'rh': rh}
+    f[0] = data_bytes[12]
+    f[1] = data_bytes[13]
+    f[2] = data_bytes[15]
+    f[3] = data_bytes[16]
+    rh = struct.unpack_from('>f', f)[0]
+
+    return Measurement(co2, temp, rh)
 
 
 ## main
 
-mi = get_measurement_interval(i2cbus, scd30_addr)
+bus = SMBus(i2cbus)
+
+mi = get_measurement_interval(bus, scd30_addr)
 print(f"measurement interval: {mi}s")
 if mi != scd30_measurement_interval:
     print(f"set measurement interval to {scd30_measurement_interval}s")
-    set_measurement_interval(i2cbus, scd30_addr, scd30_measurement_interval)
-    mi = get_measurement_interval(i2cbus, scd30_addr)
+    set_measurement_interval(bus, scd30_addr, scd30_measurement_interval)
+    mi = get_measurement_interval(bus, scd30_addr)
     print(f"measurement interval: {mi}s")
     
-temp_offset = get_temp_offset(i2cbus, scd30_addr)
+temp_offset = get_temp_offset(bus, scd30_addr)
 print(f"temperature offset: {temp_offset}/100°C")
 
 con = open('/dev/console', 'w')
 
+# wake up aligned to the SCD30 measurement interval
+next_t = time.monotonic()
 while True:
     try:
-        ready = get_data_ready(i2cbus, scd30_addr)
+        ready = get_data_ready(bus, scd30_addr)
         #print(f"ready = {ready}")
         if (ready == 1):
-            m = read_measurement(i2cbus, scd30_addr)
+            m = read_measurement(bus, scd30_addr)
             #print(f"measurement = {measurement}")
-            print(f"CO2: {m['co2']:.0f}ppm T: {m['temp']:.2f}° RH: {m['rh']:.1f}%", file=con, flush=True)
+            print(f"CO2: {m.co2:.0f}ppm T: {m.temp:.2f}° RH: {m.rh:.1f}%", file=con, flush=True)
         else:
             print("not ready", file=con, flush=True)
 
-        time.sleep(10)
-
     except Exception as e:
         print(f"ERROR: {e}", file=con, flush=True)
+
+    next_t += mi
+    now = time.monotonic()
+    if next_t < now:
+        # we fell behind, re-align to now
+        next_t = now
+    time.sleep(next_t - now)
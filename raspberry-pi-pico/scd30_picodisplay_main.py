@@ -1,75 +1,81 @@
 from machine import Pin, I2C
 from picographics import PicoGraphics, DISPLAY_PICO_DISPLAY
 from pimoroni import RGBLED
+import micropython
 import struct
 import time
+from collections import namedtuple
 
-def crc8(data):
+def make_crc8_table(polynomial=0x31):
     """
-    Calculate the CRC of the given data.
+    Return 256 byte CRC-8 lookup table for polynomial.
     
     inspired by https://github.com/Sensirion/python-i2c-driver/blob/master/sensirion_i2c_driver/crc_calculator.py
     """
-    width = 8
-    polynomial = 0x31
-    init_value = 0xff
-    final_xor = 0x00
-    
-    crc = init_value
-    for value in data:
-        crc ^= value
-        for i in range(width):
-            if crc & (1 << (width - 1)):
-                crc = (crc << 1) ^ polynomial
+    table = bytearray(256)
+    for i in range(256):
+        crc = i
+        for _ in range(8):
+            if crc & 0x80:
+                crc = ((crc << 1) ^ polynomial) & 0xff
             else:
-                crc = crc << 1
+                crc = (crc << 1) & 0xff
                 
-            crc &= (1 << width) - 1
-            
-    return crc ^ final_xor
+        table[i] = crc
+        
+    return bytes(table)
+
+# CRC-8 lookup table for SCD30 polynomial 0x31
+_CRC8 = make_crc8_table(0x31)
+
+@micropython.viper
+def crc8(data, off: int) -> int:
+    """Calculate the CRC of the 2 byte word at offset off in data (init 0xff, no final xor)."""
+    tbl = ptr8(_CRC8)
+    p = ptr8(data)
+    crc = tbl[0xff ^ p[off]]
+    crc = tbl[crc ^ p[off + 1]]
+    return crc
 
 def unpack_word(data_bytes):
     """return 16 bit word from data_bytes and check CRC in byte 3"""
-    crc = crc8(data_bytes[:2])
+    crc = crc8(data_bytes, 0)
     if crc != data_bytes[2]:
         raise ValueError(f"CRC mismatch ({hex(crc)}!={hex(data_bytes[2])}")
     
     word = int.from_bytes(data_bytes[0:2], 'big')
     return word
 
-def unpack_bytes(data_bytes):
-    """return 2 bytes from data_bytes and check CRC in byte 3"""
-    crc = crc8(data_bytes[:2])
-    if crc != data_bytes[2]:
-        raise ValueError(f"CRC mismatch ({hex(crc)}!={hex(data_bytes[2])}")
-    
-    return data_bytes[0:2]
-
 def pack_word(word):
     """return 3 bytes from 16 bit word and CRC"""
     data_bytes = bytearray(3)
     data_bytes[0:2] = word.to_bytes(2, 'big')
-    crc = crc8(data_bytes[0:2])
+    crc = crc8(data_bytes, 0)
     data_bytes[2] = crc
     return data_bytes
 
+# pre-allocated read buffers
+_buf3 = bytearray(3)
+_buf18 = bytearray(18)
+
+def _cmd_read(bus, addr, cmd, buf, delay_ms=3):
+    """send command cmd and read len(buf) bytes into buf"""
+    bus.writeto(addr, cmd)
+    time.sleep_ms(delay_ms)
+    bus.readfrom_into(addr, buf)
+    return buf
+
 def get_data_ready(bus, addr):
     """return SCD30 data ready status"""
-    # send command 0x0202
-    bus.writeto(addr, b'\x02\x02')
-    time.sleep_ms(3)
-    # read 3 bytes
-    data = bus.readfrom(addr, 3)
+    # send command 0x0202 and read 3 bytes
+    data = _cmd_read(bus, addr, b'\x02\x02', _buf3)
     value = unpack_word(data)
     return value
 
 def get_interval(bus, addr):
     """return SCD30 continuous measurement interval"""
-    # send command 0x4600
-    bus.writeto(addr, b'\x46\x00')
-    time.sleep_ms(3)
-    # read 3 bytes
-    data = bus.readfrom(addr, 3)
+    # send command 0x4600 and read 3 bytes
+    data = _cmd_read(bus, addr, b'\x46\x00', _buf3)
     value = unpack_word(data)
     return value
 
@@ -94,87 +100,131 @@ def set_forced_calibration(bus, addr, cal):
     bus.writeto(addr, b'\x52\x04' + data)
     time.sleep_ms(3)
 
+# SCD30 measurement values
+Measurement = namedtuple('Measurement', ('co2', 'temp', 'rh'))
+
+# scratch buffer for float conversion
+_scratch = bytearray(4)
+
 def read_measurement(bus, addr):
-    """return SCD30 measurement data structure"""
-    # send command 0x0300
-    bus.writeto(addr, b'\x03\x00')
-    time.sleep_ms(3)
-    # read 18 bytes
-    data = bus.readfrom(addr, 18)
+    """return SCD30 Measurement"""
+    # send command 0x0300 and read 18 bytes
+    data = _cmd_read(bus, addr, b'\x03\x00', _buf18)
     #print(f"read measurement:{data}")
+    # 6 words of 2 bytes, each followed by CRC
+    for i in range(0, 18, 3):
+        crc = crc8(data, i)
+        if crc != data[i + 2]:
+            raise ValueError(f"CRC mismatch ({hex(crc)}!={hex(data[i + 2])}")
+    # each float is two words, copy them without CRC bytes
+    f = _scratch
     # CO2
-    co2_h_bytes = data[0:3]
-    co2_h = unpack_bytes(co2_h_bytes)
-    co2_l_bytes = data[3:6]
-    co2_l = unpack_bytes(co2_l_bytes)
-    co2 = struct.unpack('!f', co2_h + co2_l)[0]
+    f[0] = data[0]
+    f[1] = data[1]
+    f[2] = data[3]
+    f[3] = data[4]
+    co2 = struct.unpack_from('>f', f)[0]
     # Temp
-    temp_h_bytes = data[6:9]
-    temp_h = unpack_bytes(temp_h_bytes)
-    temp_l_bytes = data[9:12]
-    temp_l = unpack_bytes(temp_l_bytes)
-    temp = struct.unpack('!f', temp_h + temp_l)[0]
+    f[0] = data[6]
+    f[1] = data[7]
+    f[2] = data[9]
+    f[3] = data[10]
+    temp = struct.unpack_from('>f', f)[0]
     # RH
-    rh_h_bytes = data[12:15]
-    rh_h = unpack_bytes(rh_h_bytes)
-    rh_l_bytes = data[15:18]
-    rh_l = unpack_bytes(rh_l_bytes)
-    rh = struct.unpack('!f', rh_h + rh_l)[0]
-    
-    return {'co2': co2, 'temp': temp, 'rh': rh}
+    f[0] = data[12]
+    f[1] = data[13]
+    f[2] = data[15]
+    f[3] = data[16]
+    rh = struct.unpack_from('>f', f)[0]
+
+    return Measurement(co2, temp, rh)
+
+# display pens, set in setup()
+FG = None
+BG = None
+# text currently shown on display, None forces a full redraw
+_shown_co2t = None
+_shown_envt = None
 
 def display_measurement(display, data):
-    """show measurement data on display"""
-    fg = display.create_pen(255, 255, 255)
-    bg = display.create_pen(0, 0, 0)
-    #display.set_font('bitmap8')
-    display.set_font('sans')
-    # clear 
-    display.set_pen(bg)
-    display.clear()
-    # print data
-    display.set_pen(fg)
-    # CO2 value
-    display.set_thickness(4)
-    co2t = f"{data['co2']:.0f}"
-    co2w = display.measure_text(co2t, scale=2.5)
-    co2x = 232 - co2w
-    display.text(co2t, co2x, 40, scale=2.5)
-    # ppm
-    display.set_thickness(2)
-    display.text(f"ppm", 160, 80, scale=1)
-    # temp and rH
-    display.text(f"{data['temp']:.2f}C {data['rh']:.1f}%", 10, 120, scale=1)
+    """show measurement data on display, redraw only changed lines"""
+    global _shown_co2t, _shown_envt
+    co2t = f"{data.co2:.0f}"
+    envt = f"{data.temp:.2f}C {data.rh:.1f}%"
+    if co2t == _shown_co2t and envt == _shown_envt:
+        # nothing changed, skip display update
+        return
+    
+    if _shown_co2t is None or _shown_envt is None:
+        # clear 
+        display.set_pen(BG)
+        display.clear()
+    if co2t != _shown_co2t:
+        if _shown_co2t is not None:
+            # clear CO2 and ppm lines
+            display.set_pen(BG)
+            display.rectangle(0, 0, 240, 100)
+        display.set_pen(FG)
+        # CO2 value
+        display.set_thickness(4)
+        co2w = display.measure_text(co2t, scale=2.5)
+        co2x = 232 - co2w
+        display.text(co2t, co2x, 40, scale=2.5)
+        # ppm
+        display.set_thickness(2)
+        display.text("ppm", 160, 80, scale=1)
+        _shown_co2t = co2t
+    if envt != _shown_envt:
+        if _shown_envt is not None:
+            # clear temp and rH line
+            display.set_pen(BG)
+            display.rectangle(0, 100, 240, 35)
+        display.set_pen(FG)
+        # temp and rH
+        display.set_thickness(2)
+        display.text(envt, 10, 120, scale=1)
+        _shown_envt = envt
     # show
     display.update()
 
 def display_message(display, text_message):
     """show text_message string on display"""
-    fg = display.create_pen(255, 255, 255)
-    bg = display.create_pen(0, 0, 0)
-    display.set_font('sans')
+    global _shown_co2t, _shown_envt
     display.set_thickness(2)
     text_scale = 0.9
     # clear 
-    display.set_pen(bg)
+    display.set_pen(BG)
     display.clear()
     # print data
-    display.set_pen(fg)
+    display.set_pen(FG)
     x = 10
     y = 30
     display.text(text_message, x, y, scale=text_scale)
     # show
     display.update()
+    # measurement needs full redraw
+    _shown_co2t = None
+    _shown_envt = None
+
+# LED brightness
+LED_BRGT = 0.2
+# LED red and green for CO2 range: 500=green - 1520=red in 4ppm steps
+LED_R = bytes(int(i * LED_BRGT) for i in range(256))
+LED_G = bytes(int((255 - i) * LED_BRGT) for i in range(256))
 
 def led_measurement(led, data):
     """show measurement data on RGB LED"""
-    brgt = 0.2
-    # range: 500=green - 1500=red
-    val = max(data['co2'] - 500, 0)
-    r = val / 4
-    g = max(255 - r, 0)
+    val = int(data.co2 - 500) // 4
+    if val < 256:
+        idx = max(val, 0)
+        r = LED_R[idx]
+        g = LED_G[idx]
+    else:
+        # above 1520ppm red keeps getting brighter
+        r = val * LED_BRGT
+        g = 0
     #print(f"led: {r=} {g=}")
-    led.set_rgb(r * brgt, g * brgt, 0)
+    led.set_rgb(r, g, 0)
 
 
 def setup(scd30_addr, interval):
@@ -182,6 +232,7 @@ def setup(scd30_addr, interval):
 
        Returns (i2c, display, led).
     """
+    global FG, BG
 
     # I2C bus on GPIO pins 4 and 5
     i2c = I2C(0, scl=Pin(5), sda=Pin(4), freq=100000)
@@ -198,6 +249,10 @@ def setup(scd30_addr, interval):
     # set up display
     display = PicoGraphics(display=DISPLAY_PICO_DISPLAY, rotate=0)
     display.set_backlight(1.0)
+    FG = display.create_pen(255, 255, 255)
+    BG = display.create_pen(0, 0, 0)
+    #display.set_font('bitmap8')
+    display.set_font('sans')
 
     # set up LED
     led = RGBLED(6, 7, 8)